@@ -1,23 +1,37 @@
+import collections
 import copy
 import datetime
+import functools
 import itertools
 import json
 import os
+import queue
 import re
-import statistics
 import sys
+import threading
+import time
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import (Optional, Dict, Tuple, Sequence, Any, Mapping, List, Union,
-                    cast)
-from typing import TextIO
+                    Pattern, cast)
+from typing import TextIO, Iterable, Iterator, TYPE_CHECKING
 
 import colorama
-import requests
+
+if TYPE_CHECKING:
+    # requests is imported when the first request is sent.
+    import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from prompt_toolkit.shortcuts import prompt
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.contrib.completers import WordCompleter
 from pygments import highlight, lexers, formatters
 
@@ -38,6 +52,8 @@ class Category(object):
 
 class Value(ABC):
 
+    __slots__ = ()
+
     @abstractmethod
     def display(self) -> None:
         pass
@@ -51,6 +67,108 @@ class Value(ABC):
         pass
 
 
+class HistoryWriter(threading.Thread):
+    """Appends entries to history files on a background thread so that the
+    prompt never waits for the disk."""
+
+    def __init__(self) -> None:
+        super().__init__(name='history-writer', daemon=True)
+        self.queue = queue.Queue()  # type: queue.Queue
+        self.running = False
+        self.warned = False
+
+    def write(self, filename: str, data: bytes) -> None:
+        # the thread is only started once there is something to write.
+        if not self.running:
+            self.running = True
+            self.start()
+        self.queue.put((filename, data))
+
+    def close(self) -> None:
+        """waits for every queued entry to be written."""
+        if self.running:
+            self.queue.put(None)
+            self.join()
+
+    def run(self) -> None:
+        while True:
+            # entries that queued up while the last ones were being written
+            # are written together, with one write per file.
+            items = [self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            pending = {}  # type: Dict[str, List[bytes]]
+            for item in items:
+                if item is not None:
+                    pending.setdefault(item[0], []).append(item[1])
+            for filename, chunks in pending.items():
+                try:
+                    with open(filename, 'ab') as f:
+                        f.write(b''.join(chunks))
+                except OSError as ex:
+                    # losing entries is better than stopping the writer, but
+                    # the user is told about it once.
+                    if not self.warned:
+                        self.warned = True
+                        sys.stderr.write('warning: could not write %s: %s\n'
+                                         % (filename, ex.strerror))
+            if items[-1] is None:
+                return
+
+
+class HistoryFile(FileHistory):
+    """A FileHistory that saves each new entry with a single write, on a
+    writer thread if it is given one."""
+
+    def __init__(self, filename: str,
+                 writer: Optional[HistoryWriter] = None) -> None:
+        self.writer = writer
+        super().__init__(filename)
+
+    # the most entries loaded from a history file.  Suggestions are found by
+    # scanning every entry, so long histories slow down typing.
+    MAX_HISTORY = 5000
+    # longer entries, such as large pasted payloads, are not loaded.
+    MAX_ENTRY_LENGTH = 10000
+
+    def _load(self) -> None:
+        if os.path.exists(self.filename):
+            # the file is read and decoded in one go and then split into
+            # lines, which is much quicker than reading it line by line.
+            with open(self.filename, 'rb') as f:
+                text = f.read().decode('utf-8', 'replace')
+            # repeated entries are only loaded once.
+            entries = [entry for entry, _ in itertools.groupby(
+                           self._read_entries(text.split('\n')))
+                       if len(entry) <= HistoryFile.MAX_ENTRY_LENGTH]
+            self.strings.extend(entries[-HistoryFile.MAX_HISTORY:])
+
+    @staticmethod
+    def _read_entries(lines: Iterable[str]) -> Iterator[str]:
+        """yields the entries of a history file.  Each line of an entry
+        starts with a '+' and entries are separated by comments."""
+        entry = []  # type: List[str]
+        for line in lines:
+            if line.startswith('+'):
+                entry.append(line[1:])
+            elif entry:
+                yield '\n'.join(entry)
+                entry = []
+        if entry:
+            yield '\n'.join(entry)
+
+    def append(self, string: str) -> None:
+        self.strings.append(string)
+        entry = '\n# %s\n%s' % (
+                datetime.datetime.now(),
+                ''.join('+%s\n' % line for line in string.split('\n')))
+        if self.writer:
+            self.writer.write(self.filename, entry.encode('utf-8'))
+        else:
+            with open(self.filename, 'ab') as f:
+                f.write(entry.encode('utf-8'))
+
+
 class History(object):
     """Group all history objects together."""
 
@@ -58,25 +176,52 @@ class History(object):
     PAYLOAD_HISTORY_FILE = "~/.httpsh_payload_history"
 
     def __init__(self) -> None:
-        self.command_history = FileHistory(
-                os.path.expanduser(History.COMMAND_HISTORY_FILE))
-        self.payload_history = FileHistory(
-                os.path.expanduser(History.PAYLOAD_HISTORY_FILE))
+        self.writer = HistoryWriter()
+        self.command_history = HistoryFile(
+                os.path.expanduser(History.COMMAND_HISTORY_FILE),
+                self.writer)
+        self._payload_history = None  # type: HistoryFile
+
+    @property
+    def payload_history(self) -> HistoryFile:
+        """the payload history is only loaded the first time a payload is
+        entered at the prompt."""
+        if self._payload_history is None:
+            self._payload_history = HistoryFile(
+                    os.path.expanduser(History.PAYLOAD_HISTORY_FILE),
+                    self.writer)
+        return self._payload_history
+
+    def close(self) -> None:
+        """finishes writing the history files."""
+        self.writer.close()
 
 
 class Host(Value):
 
+    __slots__ = ('alias', 'hostname', 'headers', '_header_keys',
+                 '_header_names')
+
     TYPE = 'host'
 
     def __init__(self, alias: str, hostname: str) -> None:
         self.alias = alias
         self.hostname = hostname
         self.headers = {}  # type: Dict[str, str]
+        # header names are matched ignoring case but shown as they were
+        # typed, so the lowercase names map to the names in self.headers.
+        self._header_keys = {}  # type: Dict[str, str]
+        self._header_names = None  # type: Optional[List[str]]
 
     def display(self) -> None:
-        print(style(bold(self.hostname)))
-        for header in sorted(self.headers.keys()):
-            print('  %s: %s' % (style(bold(header)), self.headers[header]))
+        print(self.format())
+
+    def format(self) -> str:
+        """returns the hostname followed by the headers, one per line."""
+        lines = [style(bold(self.hostname))]
+        lines.extend('  %s: %s' % (style(bold(header)), self.headers[header])
+                     for header in self.header_names())
+        return '\n'.join(lines)
 
     def summary(self) -> str:
         return "hostname = %s" % self.hostname
@@ -84,20 +229,154 @@ class Host(Value):
     def type(self) -> str:
         return Host.TYPE
 
+    def header_names(self) -> List[str]:
+        """returns the header names in sorted order.  The sorted list is
+        cached until the headers change."""
+        if self._header_names is None:
+            self._header_names = sorted(self.headers.keys())
+        return self._header_names
+
+    def url(self, path: str) -> str:
+        """returns the URL of a path on this host."""
+        return self.hostname + path
+
+    def get_header(self, name: str) -> Optional[str]:
+        key = self._header_keys.get(name.lower())
+        return self.headers[key] if key is not None else None
+
     def remove_header(self, name: str) -> Optional[str]:
-        return self.headers.pop(name, None)
+        key = self._header_keys.pop(name.lower(), None)
+        if key is None:
+            return None
+        self._header_names = None
+        return self.headers.pop(key)
 
     def add_header(self, name: str, value: str) -> None:
+        # setting a header again replaces it, along with its spelling.
+        self.remove_header(name)
+        self._header_names = None
+        self._header_keys[name.lower()] = name
         self.headers[name] = value
 
 
+class ResponseCache(object):
+    """Remembers GET responses that have an ETag or Last-Modified header so
+    that sending the same request again only asks the server whether the
+    response has changed.  If it hasn't, the server answers with an empty
+    304 response and the remembered response is used instead.
+
+    The least recently used responses are forgotten once there are more
+    than MAX_RESPONSES of them or their bodies add up to more than
+    MAX_BYTES.  The cache is off until the 'cache on' command is used so
+    that every request reaches the server unless asked otherwise."""
+
+    MAX_RESPONSES = 64
+    MAX_BYTES = 16 << 20
+
+    # headers of a 304 response that describe its own empty body rather
+    # than the remembered one.
+    BODY_HEADERS = frozenset(('content-length', 'content-encoding',
+                              'transfer-encoding'))
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.responses = collections.OrderedDict()  # type: Dict[Any, Any]
+        self.size = 0
+        # 'repeat -p' may send requests from several threads.
+        self.lock = threading.Lock()
+
+    def get(self, session: 'requests.Session', url: str,
+            headers: Dict[str, str]) -> Tuple['requests.Response', bool]:
+        """sends a GET request and returns the response along with whether
+        it is a remembered response that the server said hasn't changed."""
+        if not self.enabled:
+            return session.get(url, headers=headers), False
+        key = (url, frozenset(headers.items()))
+        with self.lock:
+            cached = self.responses.get(key)
+        if cached is not None:
+            headers = dict(headers)
+            if 'ETag' in cached.headers:
+                headers['If-None-Match'] = cached.headers['ETag']
+            if 'Last-Modified' in cached.headers:
+                headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        resp = session.get(url, headers=headers)
+        if resp.status_code == 304 and cached is not None:
+            resp = self._refresh(cached, resp)
+            self._store(key, resp)
+            return resp, True
+        if self._is_cacheable(resp):
+            self._store(key, resp)
+        else:
+            self._remove(key)
+        return resp, False
+
+    def clear(self) -> int:
+        """forgets every response and returns how many there were."""
+        with self.lock:
+            count = len(self.responses)
+            self.responses.clear()
+            self.size = 0
+        return count
+
+    def _refresh(self, cached, not_modified):
+        """returns a copy of a remembered response with the headers of the
+        304 response that revalidated it (e.g. a new Date)."""
+        from requests.structures import CaseInsensitiveDict
+        resp = copy.copy(cached)
+        resp.headers = CaseInsensitiveDict(cached.headers)
+        resp.headers.update(
+                (name, value) for name, value in not_modified.headers.items()
+                if name.lower() not in ResponseCache.BODY_HEADERS)
+        return resp
+
+    def _store(self, key: Any, resp) -> None:
+        size = len(resp.content)
+        if size > ResponseCache.MAX_BYTES:
+            self._remove(key)
+            return
+        with self.lock:
+            old = self.responses.pop(key, None)
+            if old is not None:
+                self.size -= len(old.content)
+            self.responses[key] = resp
+            self.size += size
+            while (len(self.responses) > ResponseCache.MAX_RESPONSES or
+                   self.size > ResponseCache.MAX_BYTES):
+                _, old = self.responses.popitem(last=False)
+                self.size -= len(old.content)
+
+    def _remove(self, key: Any) -> None:
+        with self.lock:
+            old = self.responses.pop(key, None)
+            if old is not None:
+                self.size -= len(old.content)
+
+    @staticmethod
+    def _is_cacheable(resp) -> bool:
+        return (resp.status_code == 200 and
+                ('ETag' in resp.headers or
+                 'Last-Modified' in resp.headers) and
+                'no-store' not in resp.headers.get('Cache-Control', ''))
+
+
 class Environment(object):
     """The shell's environment."""
 
+    __slots__ = ('host', 'history', 'variables', 'sessions', 'cache',
+                 'pretty')
+
+    # the most connections kept open to a single host.
+    POOL_SIZE = 16
+
     def __init__(self, history: History) -> None:
         self.host = None  # type: Host
         self.history = history
         self.variables = {}  # type: Dict[str, Value]
+        self.sessions = {}  # type: Dict[str, requests.Session]
+        self.cache = ResponseCache()
+        # whether JSON responses are indented and highlighted.
+        self.pretty = True
 
     def bind(self, name: str, value: Value) -> Value:
         if value:
@@ -109,6 +388,32 @@ class Environment(object):
     def unbind(self, name: str) -> Optional[Value]:
         return self.variables.pop(name, None)
 
+    def session_for(self, host: Host) -> 'requests.Session':
+        """returns the session used to send requests to a host.  Sessions
+        are shared by every Host with the same hostname so that connections
+        are kept alive between requests."""
+        session = self.sessions.get(host.hostname)
+        if session is None:
+            # requests takes a while to import so it isn't imported until
+            # the first request is sent.
+            import http.cookiejar
+            import requests
+            session = self.sessions[host.hostname] = requests.Session()
+            # each session only talks to one host but 'repeat -p' may use
+            # it from several threads at once.
+            adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=Environment.POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # ask for every compression urllib3 can decode, which includes
+            # brotli when it is installed.
+            from urllib3.util.request import ACCEPT_ENCODING
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            # like requests.request(), don't carry cookies between requests.
+            session.cookies.set_policy(
+                    http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
     def lookup(self, var_name: str, var_type: str=None) -> Value:
         if var_name not in self.variables:
             raise KeyError('no variable named: %s' % var_name)
@@ -152,13 +457,51 @@ class Command(ABC):
         return False
 
 
+class CommandCompleter(Completer):
+    """Completes command names at the start of the line and header names
+    after the header command."""
+
+    HEADER_COMMANDS = frozenset(('header', 'hd'))
+
+    def __init__(self, env: Environment) -> None:
+        self.env = env
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        if ' ' not in text:
+            for name in self._complete_command(text):
+                yield Completion(name, start_position=-len(text))
+            return
+        words = text.split(' ')
+        if (len(words) == 2 and words[0] in self.HEADER_COMMANDS and
+                self.env.host):
+            for name in self._complete_header(words[1]):
+                yield Completion(name, start_position=-len(words[1]))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _complete_command(prefix: str) -> Tuple[str, ...]:
+        """returns the command names starting with prefix.  The prompt asks
+        again after every keystroke so the answers are cached."""
+        return tuple(name for name in sorted(aliased_commands)
+                     if name.startswith(prefix))
+
+    def _complete_header(self, prefix: str) -> List[str]:
+        """returns the current host's header names starting with prefix,
+        ignoring case."""
+        prefix = prefix.lower()
+        return [name for name in self.env.host.header_names()
+                if name.lower().startswith(prefix)]
+
+
 class ConsoleIO(IO):
 
     def __init__(self, env: Environment) -> None:
         self.env = env
+        self.completer = CommandCompleter(env)
 
     def get_payload(self, prompt_text: str) -> JsonValue:
-        return json.loads(prompt(
+        return parse_json(prompt(
                 prompt_text,
                 auto_suggest=AutoSuggestFromHistory(),
                 history=self.env.history.payload_history).strip())
@@ -167,6 +510,7 @@ class ConsoleIO(IO):
         return prompt(
                 prompt_text,
                 auto_suggest=AutoSuggestFromHistory(),
+                completer=self.completer,
                 history=self.env.history.command_history).strip()
 
     def display_command(self, command: str, args: Sequence[str]) -> None:
@@ -174,18 +518,18 @@ class ConsoleIO(IO):
 
 
 class FileIO(IO):
-    """Reads commands from a file."""
+    """Reads commands from the lines of a script file."""
 
-    def __init__(self, file: TextIO) -> None:
-        self.file = file
+    def __init__(self, lines: Sequence[str]) -> None:
+        self.lines = iter(lines)
 
     def get_command(self, prompt_text: str) -> str:
-        line = self.file.readline()
-        return line.strip() if line else None
+        line = next(self.lines, None)
+        return line.strip() if line is not None else None
 
     def get_payload(self, prompt_text: str) -> JsonValue:
-        line = self.file.readline()
-        return json.loads(line.strip()) if line else None
+        line = next(self.lines, None)
+        return parse_json(line) if line is not None else None
 
     def display_command(self, command: str, args: Sequence[str]) -> None:
         print(style(blue(">> %s %s" % (command, ' '.join(args)))))
@@ -195,13 +539,48 @@ commands = {}  # type: Dict[str, Command]
 aliased_commands = {}  # type: Dict[str, Command]
 
 
+def parse_json(text: Union[str, bytes]) -> JsonValue:
+    """Parses a JSON string, or UTF-8 encoded bytes.  orjson is not used
+    here because it reads integers wider than 64 bits as floats."""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return json.loads(text)
+
+
+def compact_json(d: JsonValue) -> str:
+    """Formats a dictionary as a single line JSON string.  The json module
+    is always used so the output looks the same whatever the values are
+    and whether or not orjson is installed."""
+    return json.dumps(d, separators=(',', ':'), ensure_ascii=False)
+
+
 def format_json(d: JsonValue) -> str:
     """Formats a dictionary as a JSON string."""
-    return json.dumps(d, sort_keys=True, indent=3)
+    if orjson:
+        try:
+            return orjson.dumps(
+                    d,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
+        except TypeError:
+            # e.g. integers wider than 64 bits, which orjson can't write.
+            pass
+    return json.dumps(d, sort_keys=True, indent=2)
+
+
+def write_json(d: JsonValue, out: TextIO) -> None:
+    """Writes a dictionary to a stream as formatted JSON.  Without orjson,
+    the JSON is written piece by piece instead of being built as a single
+    string first."""
+    if orjson:
+        out.write(format_json(d))
+    else:
+        json.dump(d, out, sort_keys=True, indent=2)
 
 
 def colorize_json(j: str) -> str:
     """Adds color to a JSON string."""
+    if not USE_COLOR:
+        return j
     return highlight(j, lexers.JsonLexer(), formatters.TerminalFormatter())
 
 
@@ -210,24 +589,70 @@ def pretty_json(d: JsonValue) -> str:
     return colorize_json(format_json(d))
 
 
+# output is only colored when it goes to a terminal.
+USE_COLOR = sys.stdout.isatty()
+
+# ANSI escape sequences, resolved once rather than on every styled string.
+# They are empty when the output is not colored.
+BRIGHT = colorama.Style.BRIGHT if USE_COLOR else ''
+RESET = colorama.Style.RESET_ALL if USE_COLOR else ''
+BLUE = colorama.Fore.BLUE if USE_COLOR else ''
+RED = colorama.Fore.RED if USE_COLOR else ''
+GREEN = colorama.Fore.GREEN if USE_COLOR else ''
+YELLOW = colorama.Fore.YELLOW if USE_COLOR else ''
+
+
+def write_output(data: Union[str, bytes]) -> None:
+    """Writes text, or UTF-8 encoded bytes, to stdout.  Unless stdout has
+    been replaced (e.g. wrapped by colorama), bytes are written straight to
+    the binary buffer underneath stdout so large bodies needn't be
+    decoded."""
+    out = sys.stdout
+    if isinstance(data, str):
+        out.write(data)
+    elif out is sys.__stdout__ and hasattr(out, 'buffer'):
+        # text written earlier has to reach the buffer first.
+        out.flush()
+        out.buffer.write(data)
+        if out.isatty():
+            out.buffer.flush()
+    else:
+        out.write(data.decode('utf-8', 'replace'))
+
+
+def int_setting(name: str, default: int) -> int:
+    """returns the value of an integer setting taken from an environment
+    variable, or the default if the variable isn't set or isn't a
+    number."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        sys.stderr.write('warning: %s must be a number, using %d\n' % (
+                name, default))
+        return default
+
+
 def style(s: str) -> str:
-    return str(s) + colorama.Style.RESET_ALL
+    return str(s) + RESET
 
 
 def bold(s: str) -> str:
-    return colorama.Style.BRIGHT + str(s)
+    return BRIGHT + str(s)
 
 
 def blue(s: str) -> str:
-    return colorama.Fore.BLUE + str(s)
+    return BLUE + str(s)
 
 
 def red(s: str) -> str:
-    return colorama.Fore.RED + str(s)
+    return RED + str(s)
 
 
 def green(s: str) -> str:
-    return colorama.Fore.GREEN + str(s)
+    return GREEN + str(s)
 
 
 def command(command_class):
@@ -242,6 +667,8 @@ def command(command_class):
 
 class NullValue(Value):
 
+    __slots__ = ()
+
     def __init__(self) -> None:
         pass
 
@@ -257,11 +684,13 @@ class NullValue(Value):
 
 class StringValue(Value):
 
+    __slots__ = ('text', 'bold', 'color', 'bgcolor')
+
     COLORS = {
-            'red': colorama.Fore.RED,
-            'blue': colorama.Fore.BLUE,
-            'green': colorama.Fore.GREEN,
-            'yellow': colorama.Fore.YELLOW,
+            'red': RED,
+            'blue': BLUE,
+            'green': GREEN,
+            'yellow': YELLOW,
             }
 
     BGCOLORS = {
@@ -269,7 +698,7 @@ class StringValue(Value):
             'blue': colorama.Back.BLUE,
             'green': colorama.Back.GREEN,
             'yellow': colorama.Back.YELLOW,
-            }
+            } if USE_COLOR else dict.fromkeys(COLORS, '')
 
     def __init__(self, text: str, bold: bool = False,
                  color: str = None, bgcolor: str = None) -> None:
@@ -292,13 +721,13 @@ class StringValue(Value):
     def _style(self, text: str) -> str:
         result = ''
         if self.bold:
-            result += colorama.Style.BRIGHT
+            result += BRIGHT
         if self.color:
             result += StringValue.COLORS[self.color]
         if self.bgcolor:
             result += StringValue.BGCOLORS[self.bgcolor]
         result += text
-        result += colorama.Style.RESET_ALL
+        result += RESET
         return result
 
     def __str__(self):
@@ -307,6 +736,8 @@ class StringValue(Value):
 
 class ErrorString(StringValue):
 
+    __slots__ = ()
+
     def __init__(self, text: str, severe: bool = False) -> None:
         super().__init__(text, bold=True,
                          color=('red' if severe else 'yellow'))
@@ -314,84 +745,185 @@ class ErrorString(StringValue):
 
 class Response(Value):
 
+    __slots__ = ('resp', 'elapsed', 'cached', 'content_length', '_json',
+                 '_json_decoded', '_is_json', '_header_names')
+
     TYPE = 'response'
 
+    JSON_CONTENT_TYPES = frozenset({'application/json',
+                                    'application/hal+json'})
+
+    # templates for the header and status lines, with the styles filled in.
+    HEADER_FORMAT = BRIGHT + '%s' + RESET + ': %s\n'
+    STATUS_FORMAT = GREEN + BRIGHT + '%d' + RESET
+    ERROR_STATUS_FORMAT = RED + BRIGHT + '%d' + RESET
+
+    # only the start of non-JSON bodies larger than this is printed, unless
+    # HTTPSH_MAX_TEXT_BYTES is set to 0.  The whole body is still received
+    # and kept with the response.
+    MAX_TEXT_BYTES = int_setting('HTTPSH_MAX_TEXT_BYTES', 1000000)
+    TEXT_PREVIEW_BYTES = 4096
+    # JSON bodies larger than this are printed without syntax highlighting.
+    MAX_HIGHLIGHT_BYTES = 65536
+    # JSON bodies larger than this are printed as they were received.
+    MAX_FORMAT_BYTES = int_setting('HTTPSH_MAX_FORMAT_BYTES', 1 << 20)
+
     def __init__(self, resp) -> None:
         self.resp = resp
-        self.elapsed = None  # type: datetime.timedelta
+        self.elapsed = None  # type: float
+        # whether this is a remembered response that the server said
+        # hasn't changed.
+        self.cached = False
+        # the body has already been received in full.
+        self.content_length = len(resp.content)
+        self._json = None  # type: JsonValue
+        self._json_decoded = False
+        self._is_json = None  # type: bool
+        self._header_names = None  # type: List[str]
 
     def summary(self) -> str:
+        if self.cached:
+            return "status: 304 (cached), length: %d" % self.content_length
         return "status: %d, length: %d" % (
                 self.resp.status_code,
-                len(self.resp.content))
-
-    def display(self) -> None:
-        self._print_resp_headers()
-        if self.is_json():
+                self.content_length)
+
+    def display(self, pretty: bool = True) -> None:
+        # the output is collected and written with a single call.
+        parts = [self._format_resp_headers()]
+        if self.is_json() and self.content_length > Response.MAX_FORMAT_BYTES:
+            # parsing and re-formatting dominates the time taken to show
+            # large documents so they are printed as is.
+            write_output(''.join(parts))
+            write_output(self.resp.content)
+            parts = ['\n']
+        elif self.is_json():
             try:
-                print(pretty_json(self.resp.json()))
-            except json.decoder.JSONDecodeError:
+                d = self.json()
+                if not pretty:
+                    parts.append(compact_json(d) + '\n')
+                elif self.content_length > Response.MAX_HIGHLIGHT_BYTES:
+                    # highlighting needs the whole document as one string,
+                    # so large documents are streamed to stdout instead.
+                    write_output(''.join(parts))
+                    write_json(d, sys.stdout)
+                    parts = ['\n']
+                else:
+                    parts.append(pretty_json(d) + '\n')
+            except ValueError:
+                # the body is not valid JSON, or not valid UTF-8.
                 if self.resp.text.strip():
-                    print("could not decode response as JSON: %s" %
-                          self.resp.text)
+                    parts.append("could not decode response as JSON: %s\n" %
+                                 self.resp.text)
+        elif (Response.MAX_TEXT_BYTES and
+              self.content_length > Response.MAX_TEXT_BYTES):
+            parts.append(self._format_text_preview())
         elif self.resp.text.strip():
-            print(self.resp.text)
-        self._print_status_code()
-        sys.stdout.write(': ')
-        self._print_content_length(self.resp)
-        sys.stdout.write(' in ')
-        self._print_elapsed_time()
-        sys.stdout.write('\n')
-
-    def _print_content_length(self, resp) -> None:
-        sys.stdout.write("%s bytes" % style(bold(str(len(resp.content)))))
-
-    def _print_elapsed_time(self) -> None:
-        sys.stdout.write("%s seconds" %
-                         style(bold("%.3f" % self.elapsed.total_seconds())))
-
-    def _print_resp_headers(self) -> None:
-        for key in sorted(self.resp.headers.keys()):
-            print("%s: %s" %
-                  (style(bold(key)), self.resp.headers[key]))
-
-    def _print_status_code(self) -> None:
+            parts.append(self.resp.text + '\n')
+        parts.append("%s: %s in %s\n" % (self._format_status_code(),
+                                         self._format_content_length(),
+                                         self._format_elapsed_time()))
+        write_output(''.join(parts))
+
+    def _format_text_preview(self) -> str:
+        """returns the start of a large body without decoding all of it."""
+        preview = self.resp.content[:Response.TEXT_PREVIEW_BYTES]
+        return "%s\n<body truncated, %d bytes>\n" % (
+                preview.decode(self.resp.encoding or 'utf-8', 'replace'),
+                self.content_length)
+
+    def _format_content_length(self) -> str:
+        return "%s%d%s bytes" % (BRIGHT, self.content_length, RESET)
+
+    def _format_elapsed_time(self) -> str:
+        return "%s%.3f%s seconds" % (BRIGHT, self.elapsed, RESET)
+
+    def _format_resp_headers(self) -> str:
+        return ''.join(Response.HEADER_FORMAT % (key, self.resp.headers[key])
+                       for key in self.header_names())
+
+    def header_names(self) -> List[str]:
+        """returns the response's header names in sorted order.  A response
+        can be displayed many times but its headers never change, so they
+        are only sorted once."""
+        if self._header_names is None:
+            self._header_names = sorted(self.resp.headers.keys())
+        return self._header_names
+
+    def _format_status_code(self) -> str:
+        if self.cached:
+            # the server said the remembered response hasn't changed.
+            return Response.STATUS_FORMAT % 304 + ' (cached)'
         if self.resp.status_code >= 400:
-            status_code = style(red(bold(self.resp.status_code)))
-        else:
-            status_code = style(green(bold(self.resp.status_code)))
-        sys.stdout.write("%s" % status_code)
+            return Response.ERROR_STATUS_FORMAT % self.resp.status_code
+        return Response.STATUS_FORMAT % self.resp.status_code
 
     def type(self) -> str:
         return Response.TYPE
 
     def is_json(self) -> bool:
-        if 'content-type' in self.resp.headers:
-            content_type = self.resp.headers['content-type'].lower()
-            return (content_type.startswith('application/json') or
-                    content_type.startswith('application/hal+json'))
-        else:
-            return False
+        if self._is_json is None:
+            # ignore parameters such as charset=utf-8
+            content_type = self.resp.headers.get('content-type', '')
+            self._is_json = (content_type.split(';', 1)[0].strip().lower()
+                             in Response.JSON_CONTENT_TYPES)
+        return self._is_json
 
     def json(self) -> Dict:
-        return self.resp.json() if self.is_json() else None
+        """returns the JSON body of the response.  The body is only decoded
+        the first time it is needed."""
+        if not self._json_decoded:
+            self._json = self._decode_json() if self.is_json() else None
+            self._json_decoded = True
+        return self._json
+
+    def _decode_json(self) -> JsonValue:
+        from requests.utils import guess_json_utf
+        content = self.resp.content
+        try:
+            # JSON is UTF-8, UTF-16 or UTF-32 (with or without a BOM), which
+            # can be told apart from the first bytes without running
+            # chardet over the whole body the way resp.json() might.
+            return parse_json(
+                    content.decode(guess_json_utf(content) or 'utf-8'))
+        except ValueError:
+            # e.g. a body in a charset declared by the server.
+            return self.resp.json()
+
+
+class HeadResponse(Response):
+    """The response to a HEAD request, which never has a body."""
+
+    __slots__ = ()
+
+    def summary(self) -> str:
+        return "status: %d" % self.resp.status_code
+
+    def display(self, pretty: bool = True) -> None:
+        write_output("%s%s in %s\n" % (self._format_resp_headers(),
+                                       self._format_status_code(),
+                                       self._format_elapsed_time()))
+
+    def is_json(self) -> bool:
+        return False
 
 
 def find_command(tokens: Sequence[str]) -> Tuple[Command, Sequence[str]]:
     """Looks up a command based on tokens and returns the command if it was
     found or None if it wasn't.."""
-    if len(tokens) >= 3 and tokens[1] == '=':
-        var_name = tokens[0]
-        command_string = tokens[2:]
-        rvalue, args2 = find_command(command_string)
-        if not rvalue:
-            raise KeyError('could not find command: %s' %
-                           ' '.join(command_string))
-        return AssignCommand(var_name, rvalue), args2
-    elif tokens[0] in aliased_commands:
-        return aliased_commands[tokens[0]], tokens[1:]
-    else:
-        return None, tokens
+    # skip over any 'NAME =' prefixes, e.g. in 'a = b = get /'.
+    start = 0
+    while len(tokens) - start >= 3 and tokens[start + 1] == '=':
+        start += 2
+    cmd = aliased_commands.get(tokens[start])
+    if start == 0:
+        return (cmd, tokens[1:]) if cmd is not None else (None, tokens)
+    if cmd is None:
+        raise KeyError('could not find command: %s' %
+                       ' '.join(tokens[start:]))
+    for i in range(start - 2, -1, -2):
+        cmd = AssignCommand(tokens[i], cmd)
+    return cmd, tokens[start + 1:]
 
 
 @command
@@ -400,6 +932,7 @@ class HelpCommand(Command):
 
     def __init__(self) -> None:
         super().__init__('help', ['?'])
+        self._summary = None  # type: str
 
     def evaluate(self, input: IO, arguments: Sequence[str],
                  environment: Environment,
@@ -410,20 +943,27 @@ class HelpCommand(Command):
             if command:
                 print("%s" % self._format_doc_string_long(command))
         else:
-            # Lookup help for all commands
+            print(self._get_summary())
+        return NullValue()
+
+    def _get_summary(self) -> str:
+        """returns the help for all commands.  Commands are all registered
+        when the module is loaded so the text is only built once."""
+        if self._summary is None:
             grouped = itertools.groupby(
                     sorted(commands.values(), key=lambda x: x.category),
                     key=lambda x: x.category)
-
-            print("httpsh v%d.%d.%d" % VERSION)
-            print("The following are commands that you can enter in " +
-                  "the shell, grouped by category:\n")
+            lines = ["httpsh v%d.%d.%d" % VERSION,
+                     "The following are commands that you can enter in " +
+                     "the shell, grouped by category:\n"]
             for group in grouped:
-                print(style(bold(group[0] + ':')))
+                lines.append(style(bold(group[0] + ':')))
                 for command in sorted(group[1], key=lambda x: x.name):
-                    print("  %s" % self._format_doc_string_short(command))
-                print()
-        return NullValue()
+                    lines.append("  %s" %
+                                 self._format_doc_string_short(command))
+                lines.append('')
+            self._summary = '\n'.join(lines)
+        return self._summary
 
     def _format_doc_string_short(self, command: Command) -> str:
         return "%-8s - %s" % (
@@ -448,25 +988,44 @@ For example:
 
     def __init__(self) -> None:
         super().__init__('run', ['.', 'source'])
+        # the lines of each script run so far, along with the modification
+        # time of the file when it was read.
+        self._scripts = {}  # type: Dict[str, Tuple[float, List[str]]]
 
     def evaluate(self, _, arguments: Sequence[str],
                  environment: Environment,
                  value: Optional[Value] = None) -> Value:
         if arguments:
-            file_name = arguments[0]
-            with open(os.path.expanduser(file_name), 'r') as script:
-                input = FileIO(script)
-                start = datetime.datetime.now()
-                while True:
-                    success, result = read_eval_print(input, environment)
-                    if not success and not result:
-                        break
-                elapsed = datetime.datetime.now() - start
-                return StringValue("Script ran in: %.3f seconds" % (
-                        elapsed.total_seconds()), bold=True)
+            lines = self._read_script(os.path.expanduser(arguments[0]))
+            return self._run(FileIO(lines), environment)
         else:
             raise ValueError('usage: run SCRIPT_NAME')
 
+    def _read_script(self, file_name: str) -> List[str]:
+        """returns the lines of a script.  Scripts are read in one go and
+        kept until the file changes, so running a script again (e.g. with
+        repeat) doesn't read it from disk again."""
+        mtime = os.stat(file_name).st_mtime
+        cached = self._scripts.get(file_name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(file_name, 'rb') as script:
+            lines = script.read().decode('utf-8').split('\n')
+        if lines and not lines[-1]:
+            # the file ended with a newline.
+            lines.pop()
+        self._scripts[file_name] = (mtime, lines)
+        return lines
+
+    def _run(self, input: IO, environment: Environment) -> Value:
+        start = time.perf_counter()
+        while True:
+            success, result = read_eval_print(input, environment)
+            if not success and not result:
+                break
+        elapsed = time.perf_counter() - start
+        return StringValue("Script ran in: %.3f seconds" % elapsed, bold=True)
+
 
 class AssignCommand(Command):
 
@@ -493,12 +1052,16 @@ class AssignCommand(Command):
 class RepeatCommand(Command):
     """repeats a command n times and prints average time.
 
-There is no delay between repetitions.
+There is no delay between repetitions.  Use -p to run the repetitions on N
+worker threads; results are printed in order once they have all finished.
+Only get, head, options, delete and send can be run in parallel since other
+commands change the environment or prompt for a payload.
 
 For example:
 
     -> repeat 100 get /customers
     -> repeat 10 run script
+    -> repeat -p 8 100 get /customers
     """
 
     def __init__(self) -> None:
@@ -507,23 +1070,65 @@ For example:
     def evaluate(self, input: IO, arguments: Sequence[str],
                  env: Environment,
                  value: Optional[Value] = None) -> Value:
+        workers = 1
+        if len(arguments) > 2 and arguments[0] == '-p':
+            workers = int(arguments[1])
+            arguments = arguments[2:]
         repetitions = int(arguments[0])
+        if repetitions < 1 or workers < 1:
+            raise ValueError('usage: repeat [-p N] COUNT COMMAND')
         command, cmd_args = find_command(arguments[1:])
         if command:
-            times = []
-            for _ in range(0, repetitions):
-                start = datetime.datetime.now()
-                result = command.evaluate(input, cmd_args, env)
-                if result:
-                    print_command_result(result)
-                times.append((datetime.datetime.now() - start)
-                             .total_seconds())
+            if workers > 1 and not RepeatCommand._is_parallel(command):
+                raise ValueError('only get, head, options, delete and send '
+                                 'can be repeated in parallel')
+            if workers > 1:
+                total = self._repeat_parallel(input, command, cmd_args, env,
+                                              repetitions, workers)
+            else:
+                total = 0.0
+                for _ in range(0, repetitions):
+                    elapsed, result = self._run(input, command, cmd_args, env)
+                    if result:
+                        print_command_result(result, env)
+                    total += elapsed
             return StringValue(
                     'Ran command: %d times.  Average time: %f seconds' % (
-                        repetitions, statistics.mean(times)), bold=True)
+                        repetitions, total / repetitions), bold=True)
         else:
             raise KeyError('unknown command: %s' % arguments)
 
+    @staticmethod
+    def _is_parallel(command: Command) -> bool:
+        """returns whether a command can safely run on several threads at
+        once.  Other commands change the environment or read the console."""
+        return (isinstance(command, SendCommand) or
+                (isinstance(command, HttpCommand) and
+                 not isinstance(command, PayloadCommand)))
+
+    def _run(self, input: IO, command: Command, arguments: Sequence[str],
+             env: Environment) -> Tuple[float, Value]:
+        start = time.perf_counter()
+        result = command.evaluate(input, arguments, env)
+        return time.perf_counter() - start, result
+
+    def _repeat_parallel(self, input: IO, command: Command,
+                         arguments: Sequence[str], env: Environment,
+                         repetitions: int, workers: int) -> float:
+        """runs the command on a pool of threads and returns the sum of the
+        times taken by each repetition."""
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._run, input, command,
+                                       arguments, env)
+                       for _ in range(0, repetitions)]
+            total = 0.0
+            for future in futures:
+                elapsed, result = future.result()
+                if result:
+                    print_command_result(result, env)
+                total += elapsed
+        return total
+
 
 @command
 class SelectCommand(Command):
@@ -616,14 +1221,22 @@ For example:
         particular string.  The patterns currently only support one special
         character, the asterisk, which acts like a '.*' in the language of
         regular expressions."""
-        regex_pattern = '^' + pattern.replace('*', '.*') + '$'
-        return bool(re.match(regex_pattern, string))
-
-    def _get_matching_keys(self, node: Mapping[str, Any],
-                           pattern: str) -> List[str]:
-        """returns all keys in a dictionary that match the given pattern."""
+        return bool(self._compile_pattern(pattern).match(string))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _compile_pattern(pattern: str) -> Pattern:
+        """compiles a select pattern into a regular expression.  A select
+        statement tests the same few patterns against every key it visits
+        so each pattern is only compiled once."""
+        return re.compile('^' + pattern.replace('*', '.*') + '$')
+
+    def _get_matching_items(self, node: Mapping[str, Any],
+                            pattern: str) -> List[Tuple[str, Any]]:
+        """returns all items in a dictionary whose keys match the given
+        pattern."""
         if type(node) == dict:
-            return [key for key in node.keys()
+            return [(key, value) for key, value in node.items()
                     if self._matches(pattern, key)]
         return []
 
@@ -653,23 +1266,24 @@ For example:
         patterns, collect = self._parse_expression(part)
         if isinstance(node, dict):
             collected.update(
-                    {key: node[key]
-                     for c in collect_here
-                     for key in self._get_matching_keys(node, c)})
+                    item
+                    for c in collect_here
+                    for item in self._get_matching_items(node, c))
             if parts:
                 return self._verify_result(
                         {key: self._select_part(
-                           node[key], parts[0], parts[1:], collect, collected)
+                           value, parts[0], parts[1:], collect, collected)
                          for pattern in patterns
-                         for key in self._get_matching_keys(node, pattern)})
+                         for key, value in self._get_matching_items(
+                             node, pattern)})
             else:
                 return self._merge_dicts(
                             collected,
                             self._verify_result(
-                                {key: node[key]
-                                 for pattern in patterns
-                                 for key in self._get_matching_keys(
-                                     node, pattern)}))
+                                dict(item
+                                     for pattern in patterns
+                                     for item in self._get_matching_items(
+                                         node, pattern))))
         elif isinstance(node, list):
             return [self._select_part(item, ','.join(patterns),
                                       parts, collect_here, collected)
@@ -711,11 +1325,11 @@ class HttpCommand(Command):
             # Headers
             for name, value in env.host.headers.items():
                 command += " -H '%s: %s'" % (name, value)
-            if payload and 'Content-Type' not in env.host.headers:
+            if payload and env.host.get_header('Content-Type') is None:
                 command += " -H 'Content-Type: application/json'"
             # Payload if provided
             if payload:
-                command += " -d '" + json.dumps(payload) + "'"
+                command += " -d '" + compact_json(payload) + "'"
             return command
         else:
             raise ValueError("no host.  try 'help host'")
@@ -729,13 +1343,10 @@ class HttpCommand(Command):
         if host:
             path = (arguments[0] if arguments else '/')
             path = ('/' + path) if not path.startswith('/') else path
-            start = datetime.datetime.now()
-            resp = Response(requests.request(
-                    self.method,
-                    host.hostname + path,
-                    headers=host.headers,
-                    json=payload or self.get_payload(input, env)))
-            resp.elapsed = datetime.datetime.now() - start
+            payload = payload or self.get_payload(input, env)
+            start = time.perf_counter()
+            resp = self._send(env, host, path, payload)
+            resp.elapsed = time.perf_counter() - start
 
             if len(arguments) > 2 and arguments[1] == '|':
                 # filter the HTTP response through a select statement
@@ -750,9 +1361,19 @@ class HttpCommand(Command):
     def get_payload(self, input: IO, env: Environment) -> JsonValue:
         pass
 
+    def _send(self, env: Environment, host: Host, path: str,
+              payload: JsonValue) -> Response:
+        return Response(env.session_for(host).request(
+                self.method,
+                host.url(path),
+                headers=host.headers,
+                json=payload))
+
 
 class Request(Value):
 
+    __slots__ = ('host', 'command', 'path', 'payload')
+
     TYPE = 'request'
 
     def __init__(self, host: Host, command: HttpCommand,
@@ -763,11 +1384,12 @@ class Request(Value):
         self.payload = payload
 
     def display(self) -> None:
-        print(style(bold('%s Request:' % self.command.method.upper())))
-        self.host.display()
-        print(style(bold('Path: ')) + self.path)
+        lines = [style(bold('%s Request:' % self.command.method.upper())),
+                 self.host.format(),
+                 style(bold('Path: ')) + self.path]
         if self.payload:
-            print(style(bold('Payload: ')) + json.dumps(self.payload))
+            lines.append(style(bold('Payload: ')) + compact_json(self.payload))
+        print('\n'.join(lines))
 
     def summary(self) -> str:
         return "method: %s, host: %s, path: %s" % (
@@ -900,6 +1522,13 @@ For example:
     def __init__(self) -> None:
         super().__init__('head', ['HEAD'], 'head')
 
+    def _send(self, env: Environment, host: Host, path: str,
+              payload: JsonValue) -> Response:
+        return HeadResponse(env.session_for(host).head(
+                host.url(path),
+                headers=host.headers,
+                allow_redirects=False))
+
 
 @command
 class OptionsCommand(HttpCommand):
@@ -926,6 +1555,14 @@ For example:
     def __init__(self) -> None:
         super().__init__('get', ['GET', 'g'], 'get')
 
+    def _send(self, env: Environment, host: Host, path: str,
+              payload: JsonValue) -> Response:
+        resp, cached = env.cache.get(env.session_for(host), host.url(path),
+                                     host.headers)
+        response = Response(resp)
+        response.cached = cached
+        return response
+
 
 class PayloadCommand(HttpCommand):
 
@@ -1009,6 +1646,8 @@ For example:
 class HeadersCommand(Command):
     """shows the current list of headers."""
 
+    HEADER_FORMAT = BRIGHT + '%s: %s' + RESET
+
     def __init__(self) -> None:
         super().__init__('headers', ['hs'], category=Category.HOSTS)
 
@@ -1023,13 +1662,13 @@ class HeadersCommand(Command):
             return ErrorString('headers has no arguments')
 
     def _format_header(self, key: str, value: str) -> str:
-        return (style(bold("%s: %s" % (key, value))))
+        return HeadersCommand.HEADER_FORMAT % (key, value)
 
     def _get_headers(self, env: Environment) -> str:
         if env.host:
             return '\n'.join(
                     self._format_header(key, env.host.headers[key])
-                    for key in sorted(env.host.headers.keys()))
+                    for key in env.host.header_names())
         else:
             return ''
 
@@ -1058,12 +1697,9 @@ class HostsCommand(Command):
 
     def _get_hosts(self, env: Environment) -> str:
         return '\n'.join(
-                self._format_host(
-                    var_name, cast(Host, env.lookup(
-                        var_name, Host.TYPE)),
-                    env.host)
-                for var_name in sorted(env.variables.keys())
-                if env.variables[var_name].type() == Host.TYPE)
+                self._format_host(var_name, cast(Host, var), env.host)
+                for var_name, var in sorted(env.variables.items())
+                if var.type() == Host.TYPE)
 
 
 @command
@@ -1085,10 +1721,10 @@ For example:
         if not env.host:
             return ErrorString("no host.  try 'help host'")
         if len(args) == 1:
-            try:
-                return StringValue(env.host.headers[args[0]])
-            except Exception:
+            header = env.host.get_header(args[0])
+            if header is None:
                 return ErrorString("unknown header: %s" % args[0])
+            return StringValue(header)
         elif len(args) > 1:
             env.host.add_header(args[0], ' '.join(args[1:]))
             return NullValue()
@@ -1115,6 +1751,69 @@ class TypeCommand(Command):
             return ErrorString("usage: type VAR")
 
 
+@command
+class CacheCommand(Command):
+    """turns the response cache on or off, or clears it.
+
+The cache is off to begin with.  When it is on, GET responses with an ETag
+or Last-Modified header are remembered and sending the same request again
+reuses them if the server says they haven't changed.  Reused responses are
+shown with a '304 (cached)' status.
+
+For example:
+
+    -> cache
+    -> cache on
+    -> cache off
+    -> cache clear
+    """
+
+    def __init__(self) -> None:
+        super().__init__('cache', [], category=Category.ENVIRONMENT)
+
+    def evaluate(self, input: IO, args: Sequence[str],
+                 env: Environment,
+                 value: Optional[Value] = None) -> Value:
+        if len(args) == 1 and args[0] in ('on', 'off'):
+            env.cache.enabled = args[0] == 'on'
+            if not env.cache.enabled:
+                env.cache.clear()
+            return NullValue()
+        elif args == ['clear']:
+            return StringValue('removed %d responses' % env.cache.clear())
+        elif not args:
+            return StringValue('%s, %d responses' % (
+                    'on' if env.cache.enabled else 'off',
+                    len(env.cache.responses)))
+        else:
+            return ErrorString('usage: cache [on|off|clear]')
+
+
+@command
+class PrettyCommand(Command):
+    """turns pretty printing of JSON responses on or off.
+
+For example:
+
+    -> pretty
+    -> pretty off
+    """
+
+    def __init__(self) -> None:
+        super().__init__('pretty', [], category=Category.ENVIRONMENT)
+
+    def evaluate(self, input: IO, args: Sequence[str],
+                 env: Environment,
+                 value: Optional[Value] = None) -> Value:
+        if len(args) == 1 and args[0] in ('on', 'off'):
+            env.pretty = args[0] == 'on'
+            return NullValue()
+        elif not args:
+            return StringValue('on' if env.pretty else 'off')
+        else:
+            return ErrorString('usage: pretty [on|off]')
+
+
 @command
 class EnvCommand(Command):
     """displays the environment."""
@@ -1125,23 +1824,21 @@ class EnvCommand(Command):
     def evaluate(self, input: IO, args: Sequence[str],
                  env: Environment,
                  value: Optional[Value] = None) -> Value:
-        result = ''
         # Add host
-        result += style(bold('host: '))
-        if env.host:
-            result += '%s (%s)' % (env.host.hostname, env.host.alias)
-        # Add headers
         if env.host:
-            for h, v in env.host.headers.items():
-                result += '\n  %s: %s' % (style(bold(h)), v)
-        result += '\n'
+            lines = [style(bold('host: ')) + '%s (%s)' % (
+                         env.host.hostname, env.host.alias)]
+            # Add headers
+            lines.extend('  %s: %s' % (style(bold(h)), v)
+                         for h, v in env.host.headers.items())
+        else:
+            lines = [style(bold('host: '))]
         # Add variables
-        result += style(bold('variables:'))
-        for key, val in env.variables.items():
-            result += "\n  %s = %s { %s }" % (
-                style(bold(key)), env.variables[key].type(),
-                env.variables[key].summary())
-        return StringValue(result)
+        lines.append(style(bold('variables:')))
+        lines.extend("  %s = %s { %s }" % (
+                         style(bold(key)), val.type(), val.summary())
+                     for key, val in env.variables.items())
+        return StringValue('\n'.join(lines))
 
 
 @command
@@ -1200,15 +1897,10 @@ For example:
     def evaluate(self, input: IO, args: Sequence[str],
                  env: Environment,
                  value: Optional[Value] = None) -> Value:
-        result = ''
-        result += '\n'.join(
-            ["%s = %s { %s }" % (
-                style(bold(name)),
-                env.variables[name].type(),
-                env.variables[name].summary())
-                for name in sorted(env.variables.keys())
-                if env.lookup(name).type() == self.var_type])
-        return StringValue(result)
+        return StringValue('\n'.join(
+            "%s = %s { %s }" % (style(bold(name)), var.type(), var.summary())
+            for name, var in sorted(env.variables.items())
+            if var.type() == self.var_type))
 
 
 @command
@@ -1244,6 +1936,8 @@ For example:
     -> host NAME
     """
 
+    SCHEMA_COMPLETER = WordCompleter(['http', 'https'])
+
     def __init__(self) -> None:
         super().__init__('host', ['h'], category=Category.HOSTS)
 
@@ -1271,10 +1965,9 @@ For example:
             raise ValueError('could not switch to host: %s' % ex)
 
     def _get_host(self, host: str) -> str:
-        if not host.startswith('http'):
-            completer = WordCompleter(['http', 'https'])
+        if not host.startswith(('http://', 'https://')):
             text = prompt('Enter Schema [http/HTTPS]: ',
-                          completer=completer) or 'https'
+                          completer=HostCommand.SCHEMA_COMPLETER) or 'https'
             return text + '://' + host
         return host
 
@@ -1282,11 +1975,22 @@ For example:
 def read_command(line) -> Tuple[Command, Sequence[str]]:
     """Reads a command from a string and returns it."""
     if line.strip():
-        return find_command(line.split(' '))
+        command, args = parse_command(line)
+        # callers get their own copy of the cached arguments.
+        return command, list(args)
     else:
         return None, line
 
 
+@functools.lru_cache(maxsize=256)
+def parse_command(line: str) -> Tuple[Command, Tuple[str, ...]]:
+    """Parses a non-empty line into a command and its arguments.  Scripts
+    and repeated commands send the same lines again and again so the
+    results are cached."""
+    command, args = find_command(line.split(' '))
+    return command, tuple(args)
+
+
 def evaluate_command(command, input: IO, args: Sequence[str],
                      env: Environment,
                      value: Optional[Value] = None) -> Value:
@@ -1294,8 +1998,12 @@ def evaluate_command(command, input: IO, args: Sequence[str],
     return command.evaluate(input, args, env, value=value)
 
 
-def print_command_result(result: Value) -> None:
-    result.display()
+def print_command_result(result: Value, env: Environment) -> None:
+    if isinstance(result, Response):
+        # responses are shown with the current pretty printing setting.
+        result.display(env.pretty)
+    else:
+        result.display()
 
 
 def get_prompt_string(env: Environment) -> str:
@@ -1323,7 +2031,7 @@ def read_eval_print(input: IO, env: Environment) -> Tuple[bool, str]:
         input.display_command(command.name, args)
         result = evaluate_command(command, input, args, env)
         if result:
-            print_command_result(result)
+            print_command_result(result, env)
         return True, None
     else:
         return False, line
@@ -1355,7 +2063,7 @@ def version_and_exit(console: IO, env: Environment) -> None:
 
 def help_and_exit(console: IO, env: Environment) -> None:
     print_command_result(
-            find_command(['help'])[0].evaluate(console, [], env))
+            find_command(['help'])[0].evaluate(console, [], env), env)
     sys.exit(0)
 
 
@@ -1365,8 +2073,20 @@ def run_startup_script(env: Environment) -> None:
         commands['run'].evaluate(None, [startup_script], env)
 
 
+def is_connection_error(ex: BaseException) -> bool:
+    """returns whether an exception is a requests connection error.  If
+    requests hasn't been imported yet, no request has been sent."""
+    requests = sys.modules.get('requests')
+    return (requests is not None and
+            isinstance(ex, requests.exceptions.ConnectionError))
+
+
 def main() -> None:
-    colorama.init()
+    # terminals other than the Windows console understand ANSI sequences
+    # so colorama only needs to translate them there.  No sequences are
+    # written when the output is not a terminal.
+    if sys.platform == 'win32' and USE_COLOR:
+        colorama.init()
     env = Environment(History())
     console = ConsoleIO(env)
     if should_show_version():
@@ -1374,30 +2094,35 @@ def main() -> None:
     if should_show_help():
         help_and_exit(console, env)
     print(banner())
-    run_startup_script(env)
-    while True:
-        try:
-            success, result = read_eval_print(console, env)
-            if not success:
-                tokens = result.split(' ')
-                if len(tokens) == 1:
-                    env.lookup(tokens[0]).display()
-                elif result:
-                    print('unknown command or variable: %s' % result)
-        except KeyboardInterrupt:
-            print("Press Ctrl-D to quit.")
-        except KeyError as ex:
-            print(ErrorString(ex.args[0]))
-        except ValueError as ex:
-            print(ErrorString(ex.args[0]))
-        except EOFError:
-            break
-        except requests.exceptions.ConnectionError as ex:
-            print(ErrorString(str(ex)))
-        except:
-            # print some information about unexpected errors.
-            import traceback
-            traceback.print_exc()
+    try:
+        run_startup_script(env)
+        while True:
+            try:
+                success, result = read_eval_print(console, env)
+                if not success:
+                    tokens = result.split(' ')
+                    if len(tokens) == 1:
+                        print_command_result(env.lookup(tokens[0]), env)
+                    elif result:
+                        print('unknown command or variable: %s' % result)
+            except KeyboardInterrupt:
+                print("Press Ctrl-D to quit.")
+            except KeyError as ex:
+                print(ErrorString(ex.args[0]))
+            except ValueError as ex:
+                print(ErrorString(ex.args[0]))
+            except EOFError:
+                break
+            except:
+                ex = sys.exc_info()[1]
+                if is_connection_error(ex):
+                    print(ErrorString(str(ex)))
+                else:
+                    # print some information about unexpected errors.
+                    import traceback
+                    traceback.print_exc()
+    finally:
+        env.history.close()
 
 
 if __name__ == '__main__':